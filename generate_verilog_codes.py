@@ -1,13 +1,21 @@
 import os
-import json
+import orjson
+import hashlib
+import itertools
+import threading
 import re
+import shutil
+from collections import defaultdict
 from datetime import datetime
 from pathlib import Path
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from tqdm import tqdm
 from dotenv import load_dotenv
 import logging
-from typing import Dict, List, Union
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Tuple, Union
 
 # Load environment variables from .env file
 load_dotenv()
@@ -16,57 +24,199 @@ load_dotenv()
 log_filename = "generate_verilog_codes.log"
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', filename=log_filename, filemode='a')
 
+def _require_env(name: str) -> str:
+    """Return a required environment variable, exiting if it is not set."""
+    value = os.getenv(name)
+    if not value:
+        logging.error(f"{name} environment variable is not set.")
+        exit(1)
+    return value
+
+def _numeric_env(name: str, default: Union[int, float]) -> Union[int, float]:
+    """Return a numeric environment variable of the default's type, exiting if it is malformed."""
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return type(default)(value)
+    except ValueError:
+        kind = "an integer" if isinstance(default, int) else "a number"
+        logging.error(f"{name} environment variable must be {kind}, got {value!r}.")
+        exit(1)
+
 # =========================
 # TASK GENERATION PROMPT
 # =========================
-PROMPT_TASK = os.getenv("PROMPT_TASK")
-if not PROMPT_TASK:
-    logging.error("PROMPT_TASK environment variable is not set.")
+PROMPT_TASK = _require_env("PROMPT_TASK")
+PROMPT_CODE = _require_env("PROMPT_CODE")
+
+# =========================
+# Models and Endpoint
+# =========================
+# OLLAMA_API_URLS takes a comma-separated list of endpoints; OLLAMA_API_URL a single one
+OLLAMA_API_URLS = [url.strip() for url in (os.getenv("OLLAMA_API_URLS") or _require_env("OLLAMA_API_URL")).split(",") if url.strip()]
+if not OLLAMA_API_URLS:
+    logging.error("OLLAMA_API_URLS environment variable does not contain any URL.")
     exit(1)
+LLM_MODEL_TASK = _require_env("LLM_MODEL_TASK")
+LLM_MODEL_SOLUTION = _require_env("LLM_MODEL_SOLUTION")
+# Sampling temperature for both models; 0 makes responses deterministic and cacheable
+LLM_TEMPERATURE = _numeric_env("LLM_TEMPERATURE", 0.7)
+
+# Number of reports generated concurrently against Ollama
+REPORT_CONCURRENCY = _numeric_env("REPORT_CONCURRENCY", 4)
+# Number of tasks sent to Ollama in a single report request
+REPORT_BATCH_SIZE = _numeric_env("REPORT_BATCH_SIZE", 1)
+
+# Splits free-form "Task N:" responses when the model does not return valid JSON
+_TASK_SPLIT = re.compile(r'Task\s+(\d+):')
+
+# Appended to PROMPT_CODE when several tasks are reported on in one request
+BATCH_REPORT_INSTRUCTIONS = """
+
+The task content above is a JSON object whose "tasks" field maps task IDs to task descriptions.
+Write a separate, complete report for every task and respond only with a JSON object of the form
+{"reports": {"<task ID>": "<markdown report>"}} using exactly the same task IDs."""
 
 # =========================
 # Ollama API Client
 # =========================
-def generate_with_ollama(prompt: str, model: str, temperature: float = 0.7) -> Union[str, None]:
-    """Generate text using Ollama API with specified model."""
-    ollama_url = os.getenv("OLLAMA_API_URL")
-    if not ollama_url:
-        logging.error("OLLAMA_API_URL environment variable is not set.")
-        return None
+# Shared session so every request reuses pooled keep-alive connections.
+# Transient gateway errors are retried with exponential backoff, including for POST.
+# Read errors are not retried: Ollama may still be generating the original request.
+SESSION = requests.Session()
+_retry = Retry(total=3, read=0, backoff_factor=0.5, status_forcelist=[502, 503, 504], allowed_methods=["GET", "HEAD", "POST"])
+_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=max(16, REPORT_CONCURRENCY), max_retries=_retry)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+
+# Requests are spread round-robin over all configured endpoints
+_ollama_urls = itertools.cycle(OLLAMA_API_URLS)
+_ollama_urls_lock = threading.Lock()
+
+def _next_ollama_url() -> str:
+    """Return the next Ollama endpoint in round-robin order."""
+    with _ollama_urls_lock:
+        return next(_ollama_urls)
+
+# Responses for deterministic (temperature 0) calls are cached on disk
+CACHE_DIR = Path(".cache") / "ollama"
+
+def _cache_path(prompt: str, model: str, temperature: float) -> Path:
+    """Return the cache file for a given model, temperature and prompt."""
+    key = hashlib.sha256(orjson.dumps({"m": model, "t": temperature, "p": prompt}, option=orjson.OPT_SORT_KEYS)).hexdigest()
+    return CACHE_DIR / f"{key}.txt"
 
-    url = f"{ollama_url}/api/generate"
+def stream_with_ollama(prompt: str, model: str, temperature: float = 0.7) -> Iterator[str]:
+    """Yield response text from the Ollama API as it is generated."""
+    url = f"{_next_ollama_url()}/api/generate"
     payload = {
         "model": model,
         "prompt": prompt,
-        "temperature": temperature,
-        "stream": False
+        "options": {"temperature": temperature},
+        "stream": True
     }
 
-    try:
-        response = requests.post(url, json=payload)
+    with SESSION.post(url, json=payload, stream=True, timeout=(10, 120)) as response:
         response.raise_for_status()
-        return response.json().get("response", "")
-    except requests.RequestException as e:
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = orjson.loads(line)
+            if "error" in chunk:
+                raise ValueError(chunk["error"])
+            yield chunk.get("response", "")
+
+def generate_with_ollama(prompt: str, model: str, temperature: float = 0.7) -> Union[str, None]:
+    """Generate text using Ollama API with specified model."""
+    cache_file = _cache_path(prompt, model, temperature) if temperature == 0 else None
+    if cache_file and cache_file.exists():
+        logging.info(f"Using cached response: {cache_file}")
+        return cache_file.read_text(encoding='utf-8')
+
+    try:
+        response_text = "".join(stream_with_ollama(prompt, model, temperature))
+    except (requests.RequestException, ValueError) as e:
         logging.error(f"Error calling Ollama API: {e}")
         return None
 
+    if cache_file and response_text:
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            tmp_file = cache_file.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp_file.write_text(response_text, encoding='utf-8')
+            tmp_file.replace(cache_file)
+        except OSError as e:
+            logging.warning(f"Could not write response cache {cache_file}: {e}")
+    return response_text
+
+def _prewarm_endpoint(ollama_url: str) -> None:
+    """Open a keep-alive connection to one Ollama endpoint."""
+    try:
+        SESSION.get(f"{ollama_url}/api/tags", timeout=5)
+    except requests.RequestException as e:
+        logging.warning(f"Could not pre-warm connection to {ollama_url}: {e}")
+
+def prewarm_ollama() -> None:
+    """Open keep-alive connections to every Ollama endpoint before the first generation call."""
+    if len(OLLAMA_API_URLS) == 1:
+        _prewarm_endpoint(OLLAMA_API_URLS[0])
+        return
+
+    with ThreadPoolExecutor(max_workers=len(OLLAMA_API_URLS)) as executor:
+        list(executor.map(_prewarm_endpoint, OLLAMA_API_URLS))
+
 # =========================
 # JSON Sanitizer
 # =========================
+def _extract_json_fences(text: str) -> List[str]:
+    """Return the bodies of all ```json fenced blocks in a single pass."""
+    blocks = []
+    pos = 0
+    while True:
+        start = text.find("```json", pos)
+        if start < 0:
+            break
+        # Fences inside JSON strings follow an escaped newline, never a real one
+        if start > 0 and text[start - 1] != "\n":
+            pos = start + len("```json")
+            continue
+        body_start = text.find("\n", start)
+        if body_start < 0:
+            break
+        # Likewise only a fence at the start of a line closes the block, so
+        # embedded ```verilog snippets in string values are skipped
+        end = text.find("\n```", body_start)
+        if end < 0:
+            # Unterminated fence, e.g. a truncated response; keep what we have
+            blocks.append(text[body_start + 1:])
+            break
+        blocks.append(text[body_start + 1:end])
+        pos = end + 4
+    return blocks
+
+def _extract_json_payload(text: str) -> str:
+    """Return the first fenced JSON block of a response, or the whole response."""
+    cleaned = text.strip()
+    # Bare JSON is the common case; only scan for a fence when it does not parse as is
+    if cleaned.startswith(("{", "[")):
+        try:
+            orjson.loads(cleaned)
+            return cleaned
+        except orjson.JSONDecodeError:
+            pass
+    blocks = _extract_json_fences(cleaned)
+    return blocks[0].strip() if blocks else cleaned
+
 def sanitize_json(text: str) -> Dict[str, str]:
     """Extract and clean JSON content from the model response."""
     logging.info("Raw response from LLM:\n%s", text[:500] + "..." if len(text) > 500 else text)
 
-    lines = text.splitlines()
-    if lines[0].strip() == "```json" and lines[-1].strip() == "```":
-        lines = lines[1:-1]
-        cleaned = "\n".join(lines).strip()
-    else:
-        cleaned = text.strip()
+    cleaned = _extract_json_payload(text)
     logging.info("Cleaned response:\n%s", cleaned[:500] + "..." if len(cleaned) > 500 else cleaned)
     
     try:
-        parsed_json = json.loads(cleaned)
+        parsed_json = orjson.loads(cleaned)
         logging.info(f"JSON structure type: {type(parsed_json)}")
         
         result_dict = {}
@@ -83,17 +233,17 @@ def sanitize_json(text: str) -> Dict[str, str]:
                 result_dict[str(i + 1)] = item
         
         if not result_dict:
-            result_dict = {"1": json.dumps(parsed_json, indent=2)}
+            result_dict = {"1": orjson.dumps(parsed_json, option=orjson.OPT_INDENT_2).decode()}
         
         logging.info(f"Processed JSON into {len(result_dict)} tasks")
         return result_dict
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         logging.error(f"Failed to parse JSON: {e}")
         logging.error(f"Extracted content:\n{cleaned}")
         
         fallback_tasks = {}
         try:
-            task_sections = re.split(r'Task\s+(\d+):', text)
+            task_sections = _TASK_SPLIT.split(text)
             if len(task_sections) > 1:
                 for i in range(1, len(task_sections), 2):
                     task_num = task_sections[i]
@@ -112,83 +262,90 @@ def sanitize_json(text: str) -> Dict[str, str]:
 # =========================
 # Save Task Files
 # =========================
-def save_tasks_to_files(task_dict: Dict[str, Union[str, dict]]) -> List[Path]:
-    """Save each task to a separate markdown file."""
+def _write_task_file(filepath: Path, content: str) -> Union[Path, None]:
+    """Write one task file, returning its path or None on failure."""
+    try:
+        filepath.write_text(content, encoding='utf-8')
+        logging.info(f"Saved: {filepath}")
+        return filepath
+    except OSError as e:
+        logging.error(f"Error saving {filepath}: {e}")
+        return None
+
+def _dump_json(task_content: Union[dict, list]) -> str:
+    """Pretty-print structured task content as JSON."""
+    return orjson.dumps(task_content, option=orjson.OPT_INDENT_2).decode()
+
+# Serializer per exact task content type; anything else is written via str()
+_SERIALIZERS = {dict: _dump_json, list: _dump_json, str: str.strip}
+
+def _serialize_task(task_content: Union[str, dict, list]) -> str:
+    """Convert task content to the text written to its markdown file."""
+    serializer = _SERIALIZERS.get(type(task_content))
+    return serializer(task_content) if serializer else str(task_content).strip()
+
+def save_tasks_to_files(task_dict: Dict[str, Union[str, dict]]) -> Dict[Path, str]:
+    """Save each task to a separate markdown file, returning saved paths and their content."""
     tasks_dir = Path("DATA")
     tasks_dir.mkdir(exist_ok=True)
 
-    today_str = datetime.today().strftime('%Y-%m-%d')
-    saved_files = []
+    prefix = f"{datetime.today():%Y-%m-%d}_"
+    pending = []
 
+    # Resolve filenames up front; fallback IDs depend on how many tasks precede them
     for task_id, task_content in task_dict.items():
         try:
             task_num = int(task_id)
-            filename = f"{today_str}_{task_num:03d}_task.md"
-            filepath = tasks_dir / filename
-            
-            content_to_write = json.dumps(task_content, indent=2) if isinstance(task_content, dict) else task_content
-            with open(filepath, 'w') as f:
-                f.write(content_to_write.strip() if isinstance(content_to_write, str) else str(content_to_write))
-                
-            logging.info(f"Saved: {filepath}")
-            saved_files.append(filepath)
+            filepath = tasks_dir / (prefix + f"{task_num:03d}_task.md")
+
+            pending.append((filepath, _serialize_task(task_content)))
         except ValueError as e:
             logging.error(f"Error saving task {task_id}: {e}")
             if task_id != "tasks":
-                try:
-                    fallback_id = len(saved_files) + 1
-                    filename = f"{today_str}_{fallback_id:03d}_task.md"
-                    filepath = tasks_dir / filename
-                    
-                    with open(filepath, 'w') as f:
-                        if isinstance(task_content, (dict, list)):
-                            f.write(json.dumps(task_content, indent=2))
-                        else:
-                            f.write(str(task_content).strip())
-                    
-                    logging.info(f"Saved with fallback ID: {filepath}")
-                    saved_files.append(filepath)
-                except Exception as inner_e:
-                    logging.error(f"Fallback save also failed: {inner_e}")
-    return saved_files
+                fallback_id = len(pending) + 1
+                filepath = tasks_dir / (prefix + f"{fallback_id:03d}_task.md")
+                logging.info(f"Using fallback ID: {filepath}")
+                pending.append((filepath, _serialize_task(task_content)))
+
+    # A fallback ID can collide with a numbered one; keep the last content per path,
+    # as the sequential loop did, so parallel writes never race on the same file
+    files = list(dict(pending).items())
+    if not files:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=min(len(files), (os.cpu_count() or 1) * 4)) as executor:
+        results = executor.map(lambda item: _write_task_file(*item), files)
+        return {filepath: content for filepath, (_, content) in zip(results, files) if filepath}
 
 # =========================
 # Generate Tasks
 # =========================
-def generate_programming_tasks(prompt_task: str) -> List[Path]:
-    """Generate tasks and return saved file paths."""
-    logging.info(f"Generating tasks using Ollama with {os.getenv('LLM_MODEL_TASK')} model...")
+def generate_programming_tasks(prompt_task: str) -> Dict[Path, str]:
+    """Generate tasks and return saved file paths with their content."""
+    logging.info(f"Generating tasks using Ollama with {LLM_MODEL_TASK} model...")
     try:
-        response_text = generate_with_ollama(prompt_task, os.getenv('LLM_MODEL_TASK'))
+        response_text = generate_with_ollama(prompt_task, LLM_MODEL_TASK, LLM_TEMPERATURE)
         if not response_text:
             raise ValueError("Empty response from Ollama")
             
         logging.info("Received response from Ollama. Processing JSON...")
         task_dict = sanitize_json(response_text)
         logging.info(f"Successfully processed response. Contains {len(task_dict)} tasks.")
-        saved_files = save_tasks_to_files(task_dict)
-        return saved_files
+        saved_tasks = save_tasks_to_files(task_dict)
+        return saved_tasks
     except Exception as e:
         logging.error(f"Error generating tasks: {e}")
-        return []
+        return {}
 
 # =========================
 # Generate Report for One Task
 # =========================
-def generate_report_for_task(task_file_path: Path) -> Union[str, None]:
-    """Generate a report for a given task file using Ollama."""
-    with open(task_file_path, 'r') as f:
-        task_content = f.read()
-
-    prompt_code_template = os.getenv("PROMPT_CODE")
-    if not prompt_code_template:
-        logging.error("PROMPT_CODE environment variable is not set.")
-        return None
-
-    prompt_code = prompt_code_template.format(task_content=task_content)
+def generate_report_for_task(task_content: str, task_file_path: Path) -> Union[str, None]:
+    """Generate a report for the content of a given task file using Ollama."""
+    prompt_code = PROMPT_CODE.format(task_content=task_content)
 
     try:
-        response_text = generate_with_ollama(prompt_code, os.getenv('LLM_MODEL_SOLUTION'))
+        response_text = generate_with_ollama(prompt_code, LLM_MODEL_SOLUTION, LLM_TEMPERATURE)
         if not response_text:
             raise ValueError("Empty response from Ollama")
         return response_text
@@ -196,35 +353,113 @@ def generate_report_for_task(task_file_path: Path) -> Union[str, None]:
         logging.error(f"Error generating report for {task_file_path}: {e}")
         return None
 
+# =========================
+# Generate Reports for a Batch of Tasks
+# =========================
+def generate_reports_for_batch(tasks: Dict[Path, str]) -> Dict[Path, Union[str, None]]:
+    """Generate reports for several task files with a single Ollama request."""
+    if len(tasks) == 1:
+        return {task_file: generate_report_for_task(task_content, task_file) for task_file, task_content in tasks.items()}
+
+    batch = {task_file.stem: task_content for task_file, task_content in tasks.items()}
+    prompt_code = PROMPT_CODE.format(task_content=orjson.dumps({"tasks": batch}, option=orjson.OPT_INDENT_2).decode()) + BATCH_REPORT_INSTRUCTIONS
+
+    reports = {}
+    response_text = generate_with_ollama(prompt_code, LLM_MODEL_SOLUTION, LLM_TEMPERATURE)
+    if response_text:
+        try:
+            parsed = orjson.loads(_extract_json_payload(response_text))
+            reports = parsed.get("reports", {}) if isinstance(parsed, dict) else {}
+        except orjson.JSONDecodeError as e:
+            logging.error(f"Failed to parse batched reports: {e}")
+
+    results = {}
+    for task_file, task_content in tasks.items():
+        report = reports.get(task_file.stem) if isinstance(reports, dict) else None
+        if isinstance(report, str) and report.strip():
+            results[task_file] = report
+        else:
+            # Missing from the batched response; fall back to a dedicated request
+            logging.warning(f"No batched report for {task_file}, generating it separately")
+            results[task_file] = generate_report_for_task(task_content, task_file)
+    return results
+
 # =========================
 # Process All Task Files
 # =========================
-def process_task_files(task_files: List[Path]) -> None:
-    """Generate reports for given task files."""
+def _strip_code_fence(text: str, lang: str) -> str:
+    """Remove a surrounding ```lang ... ``` fence from a model response."""
+    cleaned = text.strip()
+    if cleaned.startswith(f'```{lang}'):
+        cleaned = cleaned[len(f'```{lang}'):].strip()
+    if cleaned.endswith('```'):
+        cleaned = cleaned[:-3].strip()
+    return cleaned
+
+def write_report(task_file: Path, report_content: Union[str, None]) -> Tuple[Path, Union[str, None]]:
+    """Clean a generated report and write it next to its task file."""
+    if not report_content:
+        return task_file, None
+
+    report_filename = str(task_file).replace("_task", "_output")
+    cleaned = _strip_code_fence(report_content, "markdown")
+
+    Path(report_filename).write_bytes(cleaned.encode('utf-8'))
+    return task_file, report_filename
+
+def process_batch(tasks: Dict[Path, str], writer: ThreadPoolExecutor) -> List[Future]:
+    """Generate the reports for a batch of task files and queue them for writing."""
+    reports = generate_reports_for_batch(tasks)
+    # Hand the writes off so this worker can start its next Ollama request right away
+    return [writer.submit(write_report, task_file, reports[task_file]) for task_file in tasks]
+
+def group_duplicate_tasks(tasks: Dict[Path, str]) -> Dict[Path, List[Path]]:
+    """Map the first file of each distinct task content to its duplicates."""
+    groups: Dict[str, List[Path]] = defaultdict(list)
+    for task_file, task_content in tasks.items():
+        key = hashlib.sha256(task_content.strip().encode()).hexdigest()
+        groups[key].append(task_file)
+    return {group[0]: group[1:] for group in groups.values()}
+
+def process_task_files(tasks: Dict[Path, str]) -> None:
+    """Generate reports for given task files and their content, several at a time."""
     logging.info("\nGenerating reports for each task...")
-    for task_file in tqdm(task_files, desc="Processing Tasks", unit="file"):
-        report_filename = str(task_file).replace("_task", "_output")
-        report_content = generate_report_for_task(task_file)
-
-        if report_content:
-            cleaned = report_content.strip()
-            if cleaned.startswith('```markdown'):
-                cleaned = cleaned[len('```markdown'):].strip()
-            if cleaned.endswith('```'):
-                cleaned = cleaned[:-3].strip()
-
-            with open(report_filename, 'w') as f:
-                f.write(cleaned)
-            tqdm.write(f"✔️  Generated report: {report_filename}")
-        else:
-            tqdm.write(f"❌ Failed to generate report for {task_file}")
+    duplicates = group_duplicate_tasks(tasks)
+    unique_files = list(duplicates)
+    if len(unique_files) < len(tasks):
+        logging.info(f"Skipping {len(tasks) - len(unique_files)} duplicate tasks")
+
+    batch_size = max(1, REPORT_BATCH_SIZE)
+    batches = [
+        {task_file: tasks[task_file] for task_file in unique_files[i:i + batch_size]}
+        for i in range(0, len(unique_files), batch_size)
+    ]
+    # The writer is entered first so it outlives every generation worker that submits to it
+    with ThreadPoolExecutor(max_workers=max(1, REPORT_CONCURRENCY)) as writer, \
+            ThreadPoolExecutor(max_workers=max(1, REPORT_CONCURRENCY)) as executor, \
+            tqdm(total=len(tasks), desc="Processing Tasks", unit="file") as progress:
+        futures = [executor.submit(process_batch, batch, writer) for batch in batches]
+        for future in as_completed(futures):
+            for write_future in future.result():
+                task_file, report_filename = write_future.result()
+                for duplicate_file in [task_file] + duplicates[task_file]:
+                    if not report_filename:
+                        tqdm.write(f"❌ Failed to generate report for {duplicate_file}")
+                    elif duplicate_file is task_file:
+                        tqdm.write(f"✔️  Generated report: {report_filename}")
+                    else:
+                        duplicate_report = str(duplicate_file).replace("_task", "_output")
+                        shutil.copyfile(report_filename, duplicate_report)
+                        tqdm.write(f"✔️  Copied report for duplicate task: {duplicate_report}")
+                    progress.update(1)
 
 # =========================
 # Main Execution
 # =========================
 if __name__ == "__main__":
-    task_files = generate_programming_tasks(PROMPT_TASK)
-    if task_files:
-        process_task_files(task_files)
+    prewarm_ollama()
+    tasks = generate_programming_tasks(PROMPT_TASK)
+    if tasks:
+        process_task_files(tasks)
     else:
         logging.info("No tasks generated, skipping report generation.")
\ No newline at end of file